@@ -1,9 +1,13 @@
 import asyncio
+import sys
+from collections import deque
+from itertools import dropwhile
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Dict
-from tool_detector import ToolDetector
-from tools import add_numbers, get_weather
+from tool_detector import ToolDetector, compose_tool_prompt
+from tools import add_numbers, close_http_client, get_weather
 from whisper_live.client import TranscriptionClient
-from ollama import chat, Message
+from ollama import AsyncClient, Message
 
 
 class AsyncTranscriptionProcessor:
@@ -15,25 +19,31 @@ class AsyncTranscriptionProcessor:
         log_transcription=True,
         tools: Dict[str, Callable] = {},
         model="gemma2",
+        max_history=16,
+        max_queue_size=32,
+        tool_detector: ToolDetector = None,
     ):
-        self.tool_detector = ToolDetector(tools=tools)
-
-        self.chat_messages = [
-            Message(
-                role="system",
-                content=(
-                    "You are an AI assistant primarily for chatting. "
-                    "Start the chat with 'Hey, how are you doing?'. "
-                    "Always respond to the user and keep answers short (max 3-5 sentences). "
-                    "If needed, ask the user to provide more information."
-                    f"You have these tools, which are called by a different model: {self.tool_detector.tool_manager.get_available_tools()}"
-                ),
-            )
-        ]
+        # Pass one ToolDetector to every processor in the process so concurrent
+        # sessions share its caches, in-flight requests and concurrency cap.
+        self.tool_detector = tool_detector or ToolDetector(tools=tools)
+
+        self.system_message = Message(
+            role="system",
+            content=(
+                "You are an AI assistant primarily for chatting. "
+                "Start the chat with 'Hey, how are you doing?'. "
+                "Always respond to the user and keep answers short (max 3-5 sentences). "
+                "If needed, ask the user to provide more information."
+                f"You have these tools, which are called by a different model: {self.tool_detector.tool_manager.get_available_tools()}"
+            ),
+        )
+        # Rolling window of user/assistant/tool messages; the oldest fall off
+        # automatically, so each turn sends a bounded prompt.
+        self.chat_messages = deque(maxlen=max_history)
         self.log_transcription = log_transcription
-        self.task_queue = asyncio.Queue()
+        self.task_queue = asyncio.Queue(maxsize=max_queue_size)
         self.shutdown_event = asyncio.Event()
-        self.loop = asyncio.get_event_loop()
+        self.loop = None  # Bound to the running loop in run()
         self.transcription_client = TranscriptionClient(
             host=host,
             port=port,
@@ -41,7 +51,13 @@ class AsyncTranscriptionProcessor:
             msg_callback=self.sync_on_message,  # Pass the synchronous wrapper
             log_transcription=False,
         )
+        # Whisper streaming gets its own thread so it never queues behind
+        # other run_in_executor work on the default pool.
+        self._transcribe_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="whisper"
+        )
         self.worker_task = None
+        self._aclient = AsyncClient()
 
         self.main_model_name = model
 
@@ -56,8 +72,15 @@ class AsyncTranscriptionProcessor:
     async def enqueue_message(self, message):
         """
         Enqueue a new message to the task queue.
+        When the queue is full the oldest pending message is dropped,
+        since recent transcripts matter more than stale ones.
         """
-        await self.task_queue.put(message)
+        if self.task_queue.full():
+            dropped = self.task_queue.get_nowait()
+            self.task_queue.task_done()
+            if self.log_transcription:
+                print(f"Dropped stale message: {dropped}")
+        self.task_queue.put_nowait(message)
         if self.log_transcription:
             print(f"Enqueued message: {message}")
 
@@ -80,37 +103,39 @@ class AsyncTranscriptionProcessor:
         Process a single message by sending it to the Ollama API.
         """
         self.chat_messages.append(Message(role="user", content=message))
+        # One-shot context sent with this turn only, never kept in history
+        turn_context = []
 
-        if self.tool_detector:
-            tools_output = self.tool_detector.detect_tool(message)
+        if self.tool_detector and self.tool_detector.needs_detector(message):
+            tools_output = await self.tool_detector.detect_tool(message)
             if tools_output:
-                string_out = ""
-                for x in tools_output:
-                    self.chat_messages.append(x)
-                    string_out += f"{x['message']['content']}\n"
-                final_prompt = (
-                    "Using the tool's output below, provide a concise and relevant response to the user."
-                    "\n\nTool Output:"
-                    f"\n{string_out}"
-                )
-                self.chat_messages.append(Message(role="system", content=final_prompt))
+                self.chat_messages.extend(tools_output)
+            final_prompt = compose_tool_prompt(tools_output)
+            if final_prompt:
+                turn_context.append(final_prompt)
 
         # Step 5: Send the updated conversation to the main chat model
         try:
-            response = chat(
-                model=self.main_model_name, messages=self.chat_messages, stream=True
+            response = await self._aclient.chat(
+                model=self.main_model_name,
+                messages=[self.system_message, *self._history(), *turn_context],
+                stream=True,
             )
 
-            message_content = ""
-            for chunk in response:
+            parts = []
+            async for chunk in response:
                 content = chunk["message"]["content"]
-                print(content, end="", flush=True)
-                message_content += content
-            print()  # For newline after the response
+                sys.stdout.write(content)
+                parts.append(content)
+                # Flush in batches to avoid a syscall per token
+                if len(parts) % 8 == 0:
+                    sys.stdout.flush()
+            sys.stdout.write("\n")  # For newline after the response
+            sys.stdout.flush()
 
             # Append the assistant's response to the conversation history
             self.chat_messages.append(
-                Message(role="assistant", content=message_content)
+                Message(role="assistant", content="".join(parts))
             )
 
         except Exception as e:
@@ -171,11 +196,20 @@ class AsyncTranscriptionProcessor:
         #         f"[Process Error] An error occurred while processing the message: {e}"
         #     )
 
+    def _history(self):
+        """
+        Returns the kept history starting at a user message, so a turn whose
+        user message was evicted does not leave orphaned assistant/tool replies.
+        """
+        return dropwhile(lambda m: m.role != "user", self.chat_messages)
+
     async def run_transcription_client(self):
         """
         Runs the TranscriptionClient in a separate thread to prevent blocking the event loop.
         """
-        await self.loop.run_in_executor(None, self.transcription_client)
+        await self.loop.run_in_executor(
+            self._transcribe_executor, self.transcription_client
+        )
 
     async def run_worker(self):
         """
@@ -187,6 +221,7 @@ class AsyncTranscriptionProcessor:
         """
         Starts both the transcription client and the worker.
         """
+        self.loop = asyncio.get_running_loop()
         await asyncio.gather(self.run_worker(), self.run_transcription_client())
 
     async def shutdown(self):
@@ -208,12 +243,17 @@ class AsyncTranscriptionProcessor:
             except asyncio.CancelledError:
                 print("Worker task cancelled.")
 
+        self._transcribe_executor.shutdown(wait=False, cancel_futures=True)
+        # Release pooled tool connections
+        await close_http_client()
+
 
 # Example usage
 async def main():
-    processor = AsyncTranscriptionProcessor(
+    tool_detector = ToolDetector(
         tools={"add_numbers": add_numbers, "get_weather": get_weather}
     )
+    processor = AsyncTranscriptionProcessor(tool_detector=tool_detector)
 
     try:
         # Start the transcription client and worker
@@ -1,26 +1,166 @@
+import asyncio
+from collections import OrderedDict
 from typing import Callable, List, Optional, Dict
-from ollama import chat, Message
-import json
-from tools import ToolManager
+from ollama import AsyncClient, Message
+import hashlib
+import inspect
+import logging
+import re
+import time
+from tools import ToolManager, dumps_sorted
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds a tool result stays valid; None means it never expires (pure tools).
+# Caching is opt-in: tools not listed here, e.g. run_cli_command, always run.
+TOOL_RESULT_TTL = {"add_numbers": None, "get_weather": 300, "google_search": 24 * 3600}
+
+_MISS = object()
+
+NO_TOOL = "NO_TOOL"
+
+# Words that hint at a tool request even when no tool name is mentioned.
+# Keep these specific: any match sends the message to the detector model.
+TRIGGER_WORDS = ("weather", "temperature", "add", "plus", "search", "google", "run", "execute")
+
+
+def compose_tool_prompt(tools_output: Optional[List[Message]]) -> Optional[Message]:
+    """
+    Builds the one-shot system prompt that hands tool results to the chat model.
+
+    Args:
+        tools_output (Optional[List[Message]]): Messages returned by ToolDetector.detect_tool.
+
+    Returns:
+        Optional[Message]: A system message with the tool output, or None if there is no output.
+    """
+    if not tools_output:
+        return None
+
+    string_out = "".join(f"{x.content}\n" for x in tools_output)
+    return Message(
+        role="system",
+        content=(
+            "Using the tool's output below, provide a concise and relevant response to the user."
+            "\n\nTool Output:"
+            f"\n{string_out}"
+        ),
+    )
+
+
+class ResultCache:
+    """
+    In-memory LRU in front of an optional on-disk cache, so results survive restarts.
+    Persistence is skipped when `directory` is None or diskcache is not installed.
+    """
+
+    def __init__(self, max_size: int, directory: Optional[str] = None):
+        self.max_size = max_size
+        self._memory: OrderedDict = OrderedDict()
+        self._disk = None
+        if directory and diskcache is not None:
+            self._disk = diskcache.Cache(directory, size_limit=256 * 1024 * 1024)
+
+    async def get(self, key: str):
+        """
+        Returns the cached value, or _MISS if absent or expired.
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or time.time() < expires_at:
+                self._memory.move_to_end(key)
+                return value
+            del self._memory[key]
+
+        if self._disk is None:
+            return _MISS
+        try:
+            value, expires_at = await asyncio.to_thread(
+                self._disk.get, key, _MISS, expire_time=True
+            )
+        except Exception as e:
+            # A corrupt or unreadable entry is a miss; the caller recomputes
+            # and overwrites it.
+            logger.warning("[ResultCache] Failed to read %s: %s", key, e)
+            return _MISS
+        if value is not _MISS:
+            self._store(key, value, expires_at)
+        return value
+
+    async def set(self, key: str, value, ttl: Optional[float] = None):
+        self._store(key, value, None if ttl is None else time.time() + ttl)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, value, expire=ttl)
+            except Exception as e:
+                logger.warning("[ResultCache] Failed to write %s: %s", key, e)
+
+    def _store(self, key: str, value, expires_at: Optional[float]):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
 
 
 class ToolDetector:
-    def __init__(self, model_name: str = "llama3.2", tools: Dict[str, Callable] = {}):
+    system_prompt = (
+        "You are a tool detection assistant. Determine if the user's input requires invoking a tool. "
+        "If so, specify the tool name and necessary arguments in JSON format. Otherwise, respond with 'NO_TOOL'."
+        "If you need more information to get results from a tool, respond with 'INFO_REQ' followed by the requirements."
+    )
+
+    def __init__(
+        self,
+        model_name: str = "llama3.2",
+        tools: Dict[str, Callable] = {},
+        cache_size: int = 256,
+        cache_dir: Optional[str] = "./.cache",
+        max_concurrent: int = 8,
+    ):
         """
         Initializes the ToolDetector with the specified model.
 
         Args:
             model_name (str): The name of the Ollama model used for tool detection.
+            cache_size (int): Maximum number of entries kept in each in-memory LRU cache.
+            cache_dir (Optional[str]): Directory for the persistent caches, or None to keep them in memory only.
+            max_concurrent (int): Maximum requests this detector keeps in flight, e.g. Ollama's OLLAMA_NUM_PARALLEL.
+                Share one detector between processors for the cap to apply process-wide.
         """
         self.model_name = model_name
+        self._aclient = AsyncClient()
+        self.cache_size = cache_size
+        self._detect_cache = ResultCache(
+            cache_size, cache_dir and f"{cache_dir}/tooldetector"
+        )
+        self._tool_run_cache = ResultCache(
+            cache_size, cache_dir and f"{cache_dir}/toolruns"
+        )
+        # Identical prompts from sessions sharing this detector share one request.
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._detect_slots = asyncio.Semaphore(max_concurrent)
         self.tool_manager = ToolManager(tools)
-        self.system_prompt = (
-            "You are a tool detection assistant. Determine if the user's input requires invoking a tool. "
-            "If so, specify the tool name and necessary arguments in JSON format. Otherwise, respond with 'NO_TOOL'."
-            "If you need more information to get results from a tool, respond with 'INFO_REQ' followed by the requirements."
+        # Built once so every detector call starts with byte-identical tokens,
+        # letting Ollama reuse the KV cache for the system prompt.
+        self._detector_messages_prefix = (
+            Message(role="system", content=self.system_prompt),
         )
+        # Part of the detector cache key, so editing the prompt invalidates
+        # decisions persisted under the old one.
+        self._prompt_digest = hashlib.blake2b(
+            "".join(m.content for m in self._detector_messages_prefix).encode(),
+            digest_size=8,
+        ).hexdigest()
+        self._trigger_re = self._build_trigger_re()
 
-    def detect_tool(self, user_input: str) -> Optional[List[Message]]:
+    async def detect_tool(self, user_input: str) -> Optional[List[Message]]:
         """
         Analyzes the user input to determine if a tool should be used.
 
@@ -30,45 +170,49 @@ class ToolDetector:
         Returns:
             Optional[Dict]: A dictionary containing the tool name and arguments if a tool is needed; otherwise, None.
         """
-        messages = [
-            Message(role="system", content=self.system_prompt),
-            Message(role="user", content=user_input),
-        ]
+        key = self._cache_key(user_input)
 
         try:
-            r = chat(
-                model=self.model_name,
-                messages=messages,
-                stream=False,
-                tools=self.tool_manager.tools,
-            )
+            # Only the detector's decision is cached; tools are re-run below
+            # through the tool-run cache so their own TTLs apply.
+            decision = await self._detect_cache.get(key)
+            if decision is _MISS:
+                decision = await self._detect_shared(key, user_input)
 
-            print("[ToolDetector] ", r.message.content)
+            if decision is None:
+                return None
 
-            if r.message.content and r.message.content.find("INFO_REQ") != -1:
-                return [r.message]
+            reply = Message(role="assistant", **decision)
+            logger.debug("[ToolDetector] %s", reply.content)
+
+            if reply.content and reply.content.find("INFO_REQ") != -1:
+                return [reply]
 
             messages = []
 
-            if r.message.tool_calls:
-                for tool_call in r.message.tool_calls:
-                    tool_name = tool_call.function.name
-                    tool_args = tool_call.function.arguments
+            if reply.tool_calls:
+                available = self.tool_manager.available_functions
+                calls = []
+                for tool_call in reply.tool_calls:
+                    function = tool_call.function
+                    tool_name, tool_args = function.name, function.arguments
 
                     # Execute the tool function if available
-                    function_to_call = self.tool_manager.available_functions.get(
-                        tool_name
-                    )
+                    function_to_call = available.get(tool_name)
                     if function_to_call:
-                        output = function_to_call(**tool_args)
-                        # Append the tool's output to the conversation history
-                        tool_message = Message(role="tool", content=str(output))
-                        messages.append(tool_message)
-
-            print(
-                "[ToolDetector] ",
-                json.dumps(messages),
-            )
+                        calls.append(
+                            self._run_tool(tool_name, function_to_call, tool_args)
+                        )
+
+                # Run all requested tools concurrently, keeping the call order
+                outputs = await asyncio.gather(*calls, return_exceptions=True)
+                # Append the tools' output to the conversation history
+                messages = [
+                    Message(role="tool", content=str(output)) for output in outputs
+                ]
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[ToolDetector] detector messages: %s", messages)
 
             return messages
 
@@ -76,3 +220,137 @@ class ToolDetector:
             print(f"[ToolDetector Error] {e}")
             tool_message = Message(role="tool", content=str(e))
             return [tool_message]
+
+    async def _detect_shared(self, key: str, user_input: str) -> Optional[Dict]:
+        """
+        Runs the detector for `key`, joining an identical request already in flight.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._detect_uncached(key, user_input))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one cancelled caller does not cancel the shared request
+        return await asyncio.shield(task)
+
+    async def _detect_uncached(self, key: str, user_input: str) -> Optional[Dict]:
+        messages = list(self._detector_messages_prefix) + [
+            Message(role="user", content=user_input)
+        ]
+        async with self._detect_slots:
+            reply = await self._stream_detection(messages)
+        decision = self._decision_data(reply)
+        await self._detect_cache.set(key, decision)
+        return decision
+
+    @staticmethod
+    def _decision_data(reply: Optional[Message]) -> Optional[Dict]:
+        """
+        Converts a detector reply to plain data for caching, so persisted entries
+        do not depend on the installed ollama/pydantic versions.
+        """
+        if reply is None:
+            return None
+        tool_calls = [
+            {
+                "function": {
+                    "name": tool_call.function.name,
+                    "arguments": dict(tool_call.function.arguments),
+                }
+            }
+            for tool_call in reply.tool_calls or ()
+        ]
+        return {"content": reply.content, "tool_calls": tool_calls or None}
+
+    async def _stream_detection(self, messages: List[Message]) -> Optional[Message]:
+        """
+        Streams the detector reply and stops as soon as it starts with 'NO_TOOL'.
+
+        Returns:
+            Optional[Message]: The accumulated reply, or None if no tool is needed.
+        """
+        response = await self._aclient.chat(
+            model=self.model_name,
+            messages=messages,
+            stream=True,
+            tools=self.tool_manager.tools,
+        )
+
+        parts = []
+        tool_calls = []
+        # Leading text, checked only until it either matches or rules out NO_TOOL
+        prefix = ""
+        deciding = True
+        async for chunk in response:
+            if chunk.message.tool_calls:
+                tool_calls.extend(chunk.message.tool_calls)
+            if chunk.message.content:
+                parts.append(chunk.message.content)
+
+            if deciding:
+                prefix = (prefix + (chunk.message.content or "")).lstrip()
+                if tool_calls or not NO_TOOL.startswith(prefix[: len(NO_TOOL)]):
+                    deciding = False
+                elif prefix.startswith(NO_TOOL):
+                    aclose = getattr(response, "aclose", None)
+                    if aclose:
+                        await aclose()
+                    return None
+
+        return Message(
+            role="assistant", content="".join(parts), tool_calls=tool_calls or None
+        )
+
+    def needs_detector(self, text: str) -> bool:
+        """
+        Cheap local check run before detect_tool. Short messages (three words
+        or fewer) without any tool-related word skip the detector model.
+        """
+        if len(text.split()) > 3:
+            return True
+        return self._trigger_re.search(text) is not None
+
+    def _build_trigger_re(self) -> re.Pattern:
+        # Whole tool names only; their parts and parameter names ("get", "first",
+        # "location") are everyday words that would let chit-chat through.
+        words = set(TRIGGER_WORDS)
+        words.update(tool["name"] for tool in self.tool_manager.tools)
+        words.update(self.tool_manager.available_functions)
+        alternatives = "|".join(sorted(map(re.escape, words)))
+        return re.compile(rf"\b(?:{alternatives}|\d+)\b", re.IGNORECASE)
+
+    def _cache_key(self, user_input: str) -> str:
+        normalized = user_input.strip().lower()
+        digest = hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+        return (
+            f"{self.model_name}:{self.tool_manager.tools_digest}:"
+            f"{self._prompt_digest}:{digest}"
+        )
+
+    async def _run_tool(self, tool_name: str, function: Callable, tool_args: Dict):
+        """
+        Executes a tool, reusing a previous result for identical arguments.
+        Only tools listed in TOOL_RESULT_TTL are cached; errors are never cached.
+        """
+        if tool_name not in TOOL_RESULT_TTL:
+            return await self._call_tool(function, tool_args)
+        ttl = TOOL_RESULT_TTL[tool_name]
+
+        try:
+            key = f"{tool_name}:{dumps_sorted(tool_args).decode()}"
+        except (TypeError, ValueError):
+            # Arguments that cannot be serialized are run uncached
+            return await self._call_tool(function, tool_args)
+        output = await self._tool_run_cache.get(key)
+        if output is _MISS:
+            output = await self._call_tool(function, tool_args)
+            # Tools report failures as {"error": ...}; those must be retried, not cached
+            if not (isinstance(output, dict) and "error" in output):
+                await self._tool_run_cache.set(key, output, ttl)
+        return output
+
+    @staticmethod
+    async def _call_tool(function: Callable, tool_args: Dict):
+        if inspect.iscoroutinefunction(function):
+            return await function(**tool_args)
+        return await asyncio.to_thread(function, **tool_args)
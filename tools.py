@@ -1,13 +1,63 @@
+from types import MappingProxyType
 from typing import Callable, Dict
-import requests
+import asyncio
+import hashlib
+import inspect
+import httpx
 import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
+
+# Shared client so repeated tool calls reuse pooled keep-alive connections.
+_HTTPX = httpx.AsyncClient(
+    timeout=5.0, limits=httpx.Limits(max_keepalive_connections=4)
+)
+
+
+async def close_http_client():
+    """
+    Closes the pooled HTTP client used by tools. Call once on shutdown.
+    """
+    await _HTTPX.aclose()
+
+
+def dumps_sorted(obj) -> bytes:
+    """
+    Serializes `obj` to UTF-8 JSON with sorted keys, using orjson when available.
+    Values JSON cannot represent fall back to str().
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS, default=str)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the json module handles
+            pass
+    # Compact separators match orjson for strings, ints and containers. Floats
+    # can still be formatted differently (1e16 vs 1e+16, NaN vs null), so keys
+    # built here are only stable for a given choice of JSON library.
+    return json.dumps(
+        obj, sort_keys=True, default=str, separators=(",", ":"), ensure_ascii=False
+    ).encode()
+
+
+def loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 def add_numbers(first: int, second: int) -> int:
     return first + second
 
 
-def get_weather(latitude: float, longitude: float) -> dict:
+async def get_weather(latitude: float, longitude: float) -> dict:
     """
     Retrieves the current weather for the specified latitude and longitude using Open-Meteo.
 
@@ -27,8 +77,8 @@ def get_weather(latitude: float, longitude: float) -> dict:
             "timezone": "auto",
         }
 
-        response = requests.get(url, params=params)
-        data = response.json()
+        response = await _HTTPX.get(url, params=params)
+        data = loads(response.content)
 
         if "current_weather" in data:
             weather = data["current_weather"]
@@ -44,7 +94,7 @@ def get_weather(latitude: float, longitude: float) -> dict:
         return {"error": str(e)}
 
 
-tools_json = [
+tools_json = (
     {
         "name": "add_numbers",
         "description": "Add two numbers together",
@@ -77,27 +127,38 @@ tools_json = [
             "required": ["location"],
         },
     },
-]
+)
+
+# Serialized once at import; the digest identifies this exact schema set so
+# cached detector results never outlive a schema change.
+_TOOLS_SERIALIZED = dumps_sorted(tools_json)
+TOOLS_DIGEST = hashlib.blake2b(_TOOLS_SERIALIZED, digest_size=8).hexdigest()
 
 
 class ToolManager:
     def __init__(self, available_functions: Dict[str, Callable]):
-        self.available_functions = available_functions
+        # Read-only so tool registrations cannot change between requests
+        self.available_functions = MappingProxyType(dict(available_functions))
         self.tools = tools_json
-        print("[ToolManager] Initialized with ", json.dumps(tools_json))
-
-    def get_available_tools(self):
-        return "\n".join(
+        self.tools_digest = TOOLS_DIGEST
+        self._tools_description = "\n".join(
             f"Function {tool['name']} to {tool['description']}:\n{tool}"
-            for tool in tools_json
+            for tool in self.tools
         )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[ToolManager] Initialized with %s", _TOOLS_SERIALIZED.decode())
+
+    def get_available_tools(self):
+        return self._tools_description
 
-    def execute_tool(self, tool_name: str, **kwargs):
+    async def execute_tool(self, tool_name: str, **kwargs):
         function = self.available_functions.get(tool_name)
         if not function:
             return f"Error: Tool '{tool_name}' not found."
 
         try:
-            return function(**kwargs)
+            if inspect.iscoroutinefunction(function):
+                return await function(**kwargs)
+            return await asyncio.to_thread(function, **kwargs)
         except Exception as e:
             return f"Error executing tool '{tool_name}': {str(e)}"